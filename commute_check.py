@@ -1,34 +1,182 @@
 import os
-import math
+import base64
 import json
-from datetime import datetime
-from typing import Any, Dict, Tuple
+import sqlite3
+import struct
+import time
+import functools
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
 
 import requests
-from requests.auth import HTTPBasicAuth
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 TOMTOM_ROUTE_BASE = "https://api.tomtom.com/routing/1/calculateRoute"
 MAILJET_SEND_URL = "https://api.mailjet.com/v3.1/send"
+ROUTE_CACHE_TTL_SEC = 600
+
+# Fixed query params, pre-encoded once; only the API key varies per call.
+_TOMTOM_STATIC_QS = "traffic=true&computeTravelTimeFor=all&routeRepresentation=summaryOnly"
+
+# One slot per (weekday, hour): bitmap of slots that ever alerted, per-slot counts of
+# real TomTom fetches, and per-slot consecutive skips since the last fetch.
+HISTORY_SLOTS = 7 * 24
+_HISTORY_BITMAP_BYTES = (HISTORY_SLOTS + 7) // 8
+_HISTORY_FMT = f"<{_HISTORY_BITMAP_BYTES}s{HISTORY_SLOTS}H{HISTORY_SLOTS}H"
+
+REQUIRED_ENV = [
+    "TOMTOM_API_KEY",
+    "COMMUTE_ORIGIN_LAT", "COMMUTE_ORIGIN_LNG",
+    "COMMUTE_DEST_LAT", "COMMUTE_DEST_LNG",
+]
+
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    tomtom_key: str
+    origin: Tuple[int, int]  # microdegrees
+    dest: Tuple[int, int]
+    route_locs: str
+    thresh_min: int
+    thresh_pct: float
+    mj_pub: Optional[str]
+    mj_priv: Optional[str]
+    email_to: Optional[str]
+    email_from: Optional[str]
+    state_dir: str
+    skip_on_history: bool
+    history_min_runs: int
+    history_reprobe_every: int
+    force_check: bool
+
+
+def _microdegrees(name: str) -> int:
+    return int(round(float(os.environ[name]) * 1_000_000))
+
+
+def _fmt_microdegrees(v: int) -> str:
+    return f"{v / 1_000_000:.6f}"
+
+
+@functools.lru_cache(maxsize=1)
+def _config() -> Config:
+    # Read and parse env once per process; callers check REQUIRED_ENV first.
+    # Coordinates are quantized to ~0.1 m so the URL and cache key are stable.
+    origin = (_microdegrees("COMMUTE_ORIGIN_LAT"), _microdegrees("COMMUTE_ORIGIN_LNG"))
+    dest = (_microdegrees("COMMUTE_DEST_LAT"), _microdegrees("COMMUTE_DEST_LNG"))
+    route_locs = ":".join(f"{_fmt_microdegrees(lat)},{_fmt_microdegrees(lng)}" for lat, lng in (origin, dest))
+    return Config(
+        tomtom_key=os.environ["TOMTOM_API_KEY"],
+        origin=origin,
+        dest=dest,
+        route_locs=route_locs,
+        thresh_min=int(os.getenv("DELAY_THRESHOLD_MIN", "15")),
+        thresh_pct=float(os.getenv("DELAY_THRESHOLD_PCT", "30")),
+        mj_pub=os.getenv("MJ_APIKEY_PUBLIC"),
+        mj_priv=os.getenv("MJ_APIKEY_PRIVATE"),
+        email_to=os.getenv("EMAIL_TO"),
+        email_from=os.getenv("EMAIL_FROM"),
+        state_dir=os.getenv("STATE_DIR", ".state"),
+        skip_on_history=os.getenv("SKIP_ON_HISTORY") == "1",
+        history_min_runs=int(os.getenv("SKIP_ON_HISTORY_MIN_RUNS", "8")),
+        history_reprobe_every=int(os.getenv("SKIP_ON_HISTORY_REPROBE_EVERY", "4")),
+        force_check=bool(os.getenv("FORCE_CHECK")),
+    )
 
 
-def tomtom_route_summary(api_key: str, origin: Tuple[float, float], dest: Tuple[float, float]) -> Dict[str, Any]:
-    route_locs = f"{origin[0]},{origin[1]}:{dest[0]},{dest[1]}"
-    url = f"{TOMTOM_ROUTE_BASE}/{route_locs}/json"
+_SESSION: Optional[requests.Session] = None
+
+
+def _get_session() -> requests.Session:
+    # One pooled session so TomTom + Mailjet reuse keep-alive connections
+    # instead of paying a fresh TLS handshake per request.
+    global _SESSION
+    if _SESSION is None:
+        s = requests.Session()
+        # Only backoff_factor waits (never a server Retry-After), and once retries
+        # run out the last response comes back so callers still raise_for_status().
+        retry = Retry(
+            total=2,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            respect_retry_after_header=False,
+            raise_on_status=False,
+        )
+        s.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry))
+        _SESSION = s
+    return _SESSION
+
+
+def _route_cache_key(origin: Tuple[int, int], dest: Tuple[int, int]) -> str:
+    # Integer microdegrees, so float noise in the env values can't cause a miss.
+    # 10-minute bucket: traffic doesn't move enough within it to matter for the thresholds
+    bucket = datetime.now().strftime("%a%H%M")[:-1] + "0"
+    return f"{origin[0]},{origin[1]}|{dest[0]},{dest[1]}|{bucket}"
+
+
+def _route_cache_open(cache_path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    db = sqlite3.connect(cache_path)
+    db.execute("CREATE TABLE IF NOT EXISTS routes (key TEXT PRIMARY KEY, expires_at INTEGER, payload BLOB)")
+    return db
 
-    params = {
-        "key": api_key,
-        "traffic": "true",
-        "computeTravelTimeFor": "all",
-        "routeRepresentation": "polyline",
-    }
 
-    r = requests.get(url, params=params, timeout=25)
+def _route_cache_get(cache_path: str, key: str) -> Optional[Dict[str, Any]]:
+    # The cache is best effort: a corrupt/locked db, unwritable STATE_DIR or a
+    # payload that isn't a summary dict is a miss.
+    try:
+        db = _route_cache_open(cache_path)
+        try:
+            row = db.execute(
+                "SELECT payload FROM routes WHERE key = ? AND expires_at > ?", (key, int(time.time()))
+            ).fetchone()
+        finally:
+            db.close()
+        cached = json.loads(row[0]) if row else None
+    except (sqlite3.Error, OSError, ValueError, TypeError):
+        return None
+    if not (isinstance(cached, dict) and "ok" in cached):
+        return None
+    return cached
+
+
+def _route_cache_put(cache_path: str, key: str, result: Dict[str, Any]) -> None:
+    try:
+        db = _route_cache_open(cache_path)
+        try:
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO routes (key, expires_at, payload) VALUES (?, ?, ?)",
+                    (key, int(time.time()) + ROUTE_CACHE_TTL_SEC, json.dumps(result).encode("utf-8")),
+                )
+        finally:
+            db.close()
+    except (sqlite3.Error, OSError):
+        pass
+
+
+def tomtom_route_summary(
+    api_key: str,
+    route_locs: str,
+    cache: Optional[Tuple[str, str]] = None,
+) -> Dict[str, Any]:
+    # cache: optional (routes.db path, key from _route_cache_key)
+    if cache:
+        cached = _route_cache_get(*cache)
+        if cached is not None:
+            return {**cached, "cached": True}
+
+    url = f"{TOMTOM_ROUTE_BASE}/{route_locs}/json?key={api_key}&{_TOMTOM_STATIC_QS}"
+
+    r = _get_session().get(url, timeout=25)
     r.raise_for_status()
     data = r.json()
 
     routes = data.get("routes") or []
     if not routes:
-        return {"ok": False, "reason": "No routes returned", "raw": data}
+        return {"ok": False, "reason": "No routes returned"}
 
     summary = routes[0].get("summary") or {}
     travel = int(summary.get("travelTimeInSeconds", 0))
@@ -36,16 +184,24 @@ def tomtom_route_summary(api_key: str, origin: Tuple[float, float], dest: Tuple[
     delay = int(summary.get("trafficDelayInSeconds", max(0, travel - (no_traffic or travel))))
 
     if travel <= 0:
-        return {"ok": False, "reason": "Invalid travel time in response", "raw": data}
+        return {"ok": False, "reason": "Invalid travel time in response"}
     if no_traffic <= 0:
         no_traffic = travel
 
-    return {
+    result = {
         "ok": True,
         "travel_sec": travel,
         "no_traffic_sec": no_traffic,
         "delay_sec": max(0, delay),
     }
+    if cache:
+        _route_cache_put(*cache, result)
+    return result
+
+
+@functools.lru_cache(maxsize=4)
+def _basic_auth_header(api_key: str, api_secret: str) -> str:
+    return "Basic " + base64.b64encode(f"{api_key}:{api_secret}".encode("utf-8")).decode("ascii")
 
 
 def mailjet_send(api_key: str, api_secret: str, email_from: str, email_to: str, subject: str, text: str) -> None:
@@ -61,11 +217,10 @@ def mailjet_send(api_key: str, api_secret: str, email_from: str, email_to: str,
         ]
     }
 
-    r = requests.post(
+    r = _get_session().post(
         MAILJET_SEND_URL,
-        auth=HTTPBasicAuth(api_key, api_secret),
-        headers={"Content-Type": "application/json"},
-        data=json.dumps(payload),
+        headers={"Authorization": _basic_auth_header(api_key, api_secret)},
+        json=payload,
         timeout=25,
     )
 
@@ -90,39 +245,102 @@ def mailjet_send(api_key: str, api_secret: str, email_from: str, email_to: str,
 
 
 def already_alerted_today(state_dir: str, today_key: str) -> bool:
-    os.makedirs(state_dir, exist_ok=True)
+    # The marker file's mtime is the last alert date; one stat, no read.
     path = os.path.join(state_dir, "last_alert_date.txt")
-    if not os.path.exists(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
         return False
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read().strip() == today_key
+    return date.fromtimestamp(st.st_mtime).isoformat() == today_key
 
 
-def mark_alerted_today(state_dir: str, today_key: str) -> None:
+def mark_alerted_today(state_dir: str) -> None:
     os.makedirs(state_dir, exist_ok=True)
     path = os.path.join(state_dir, "last_alert_date.txt")
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(today_key)
+    open(path, "a").close()
+    os.utime(path, None)
+
+
+def history_slot(now: datetime) -> int:
+    return now.weekday() * 24 + now.hour
+
+
+def load_hour_history(state_dir: str) -> Tuple[int, List[int], List[int]]:
+    path = os.path.join(state_dir, "hour_alert_bitmap.bin")
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+    except FileNotFoundError:
+        raw = b""
+    if len(raw) != struct.calcsize(_HISTORY_FMT):
+        return 0, [0] * HISTORY_SLOTS, [0] * HISTORY_SLOTS
+    bits, *counts = struct.unpack(_HISTORY_FMT, raw)
+    return int.from_bytes(bits, "little"), counts[:HISTORY_SLOTS], counts[HISTORY_SLOTS:]
+
+
+def save_hour_history(state_dir: str, bitmap: int, runs: List[int], skips: List[int]) -> None:
+    os.makedirs(state_dir, exist_ok=True)
+    path = os.path.join(state_dir, "hour_alert_bitmap.bin")
+    with open(path, "wb") as f:
+        f.write(struct.pack(_HISTORY_FMT, bitmap.to_bytes(_HISTORY_BITMAP_BYTES, "little"), *runs, *skips))
+
+
+def should_skip_by_history(
+    bitmap: int, runs: List[int], skips: List[int], slot: int, min_runs: int, reprobe_every: int
+) -> bool:
+    # Never skip a slot that has alerted or hasn't been sampled enough; otherwise
+    # fall through to a real check after reprobe_every consecutive skips.
+    if (bitmap >> slot) & 1 or runs[slot] < min_runs:
+        return False
+    return skips[slot] < reprobe_every
+
+
+def record_hour_history(state_dir: str, slot: int, alerted: bool) -> None:
+    # Call only for real TomTom fetches; resets the slot's skip streak.
+    bitmap, runs, skips = load_hour_history(state_dir)
+    runs[slot] = min(runs[slot] + 1, 0xFFFF)
+    skips[slot] = 0
+    if alerted:
+        bitmap |= 1 << slot
+    save_hour_history(state_dir, bitmap, runs, skips)
+
+
+def record_hour_skip(state_dir: str, slot: int) -> None:
+    bitmap, runs, skips = load_hour_history(state_dir)
+    skips[slot] = min(skips[slot] + 1, 0xFFFF)
+    save_hour_history(state_dir, bitmap, runs, skips)
 
 
 def main() -> int:
-    required = [
-        "TOMTOM_API_KEY",
-        "COMMUTE_ORIGIN_LAT", "COMMUTE_ORIGIN_LNG",
-        "COMMUTE_DEST_LAT", "COMMUTE_DEST_LNG",
-    ]
-    missing = [k for k in required if not os.getenv(k)]
+    missing = [k for k in REQUIRED_ENV if not os.getenv(k)]
     if missing:
         print(f"Missing required env vars: {', '.join(missing)}")
         return 2
 
-    origin = (float(os.environ["COMMUTE_ORIGIN_LAT"]), float(os.environ["COMMUTE_ORIGIN_LNG"]))
-    dest = (float(os.environ["COMMUTE_DEST_LAT"]), float(os.environ["COMMUTE_DEST_LNG"]))
+    cfg = _config()
 
-    delay_thresh_min = int(os.getenv("DELAY_THRESHOLD_MIN", "15"))
-    delay_thresh_pct = float(os.getenv("DELAY_THRESHOLD_PCT", "30"))
+    # daily dedupe (important because we run twice around DST); checked before
+    # TomTom so the second run of the day costs no API call. FORCE_CHECK still
+    # reports the commute, but the email is skipped below.
+    today_key = date.today().isoformat()
+    if already_alerted_today(cfg.state_dir, today_key) and not cfg.force_check:
+        print("ℹ️ Alert already sent today; skipping check.")
+        return 0
 
-    tt = tomtom_route_summary(os.environ["TOMTOM_API_KEY"], origin, dest)
+    # Optional: skip hours that have been checked often enough and never alerted
+    slot = history_slot(datetime.now())
+    if cfg.skip_on_history and not cfg.force_check:
+        bitmap, runs, skips = load_hour_history(cfg.state_dir)
+        if should_skip_by_history(bitmap, runs, skips, slot, cfg.history_min_runs, cfg.history_reprobe_every):
+            record_hour_skip(cfg.state_dir, slot)
+            print(f"ℹ️ Skipping by history: no alerts in {runs[slot]} previous runs at this weekday/hour.")
+            return 0
+
+    tt = tomtom_route_summary(
+        cfg.tomtom_key,
+        cfg.route_locs,
+        cache=(os.path.join(cfg.state_dir, "routes.db"), _route_cache_key(cfg.origin, cfg.dest)),
+    )
     if not tt["ok"]:
         print(f"⚠️ TomTom routing failed: {tt.get('reason')}")
         return 0
@@ -131,10 +349,11 @@ def main() -> int:
     no_traffic = tt["no_traffic_sec"]
     delay = tt["delay_sec"]
 
-    travel_min = math.ceil(travel / 60)
-    no_traffic_min = math.ceil(no_traffic / 60)
-    delay_min = math.ceil(delay / 60) if delay > 0 else 0
-    delay_pct = (delay / no_traffic) * 100.0 if no_traffic else 0.0
+    # ceil-div on non-negative int seconds, no float round trip
+    travel_min = -(-travel // 60)
+    no_traffic_min = -(-no_traffic // 60)
+    delay_min = -(-delay // 60)
+    delay_pct = (delay * 100) / no_traffic if no_traffic else 0.0
 
     print(
         f"⏱️ Commute (TomTom)\n"
@@ -143,27 +362,21 @@ def main() -> int:
         f"- Delay:           {delay_min} min ({delay_pct:.0f}%)"
     )
 
-    is_bad = (delay_min >= delay_thresh_min) or (delay_pct >= delay_thresh_pct)
+    is_bad = (delay_min >= cfg.thresh_min) or (delay_pct >= cfg.thresh_pct)
+    if cfg.skip_on_history and not tt.get("cached"):
+        record_hour_history(cfg.state_dir, slot, is_bad)
     if not is_bad:
         print("✅ No significant delay.")
         return 0
 
-    print(f"🚧 ALERT: Delay exceeds threshold (>= {delay_thresh_min} min OR >= {delay_thresh_pct:.0f}%).")
+    print(f"🚧 ALERT: Delay exceeds threshold (>= {cfg.thresh_min} min OR >= {cfg.thresh_pct:.0f}%).")
 
-    # daily dedupe (important because we run twice around DST)
-    today_key = datetime.now().strftime("%Y-%m-%d")
-    state_dir = os.getenv("STATE_DIR", ".state")
-    if already_alerted_today(state_dir, today_key):
+    if already_alerted_today(cfg.state_dir, today_key):
         print("ℹ️ Alert already sent today; skipping email to avoid duplicates.")
         return 0
 
     # Mailjet creds (optional until you add secrets)
-    mj_pub = os.getenv("MJ_APIKEY_PUBLIC")
-    mj_priv = os.getenv("MJ_APIKEY_PRIVATE")
-    email_to = os.getenv("EMAIL_TO")
-    email_from = os.getenv("EMAIL_FROM")
-
-    if not (mj_pub and mj_priv and email_to and email_from):
+    if not (cfg.mj_pub and cfg.mj_priv and cfg.email_to and cfg.email_from):
         print("ℹ️ Mailjet secrets not set (MJ_APIKEY_PUBLIC/MJ_APIKEY_PRIVATE/EMAIL_TO/EMAIL_FROM). Not sending email yet.")
         return 0
 
@@ -175,8 +388,8 @@ def main() -> int:
         f"Delay:           {delay_min} min ({delay_pct:.0f}%)\n"
     )
 
-    mailjet_send(mj_pub, mj_priv, email_from, email_to, subject, body)
-    mark_alerted_today(state_dir, today_key)
+    mailjet_send(cfg.mj_pub, cfg.mj_priv, cfg.email_from, cfg.email_to, subject, body)
+    mark_alerted_today(cfg.state_dir)
     print("📧 Mailjet email alert sent.")
     return 0
 
@@ -0,0 +1,222 @@
+import os
+import sqlite3
+import struct
+import time
+from datetime import date
+
+import commute_check as cc
+
+SUMMARY = {"ok": True, "travel_sec": 1500, "no_traffic_sec": 1200, "delay_sec": 300}
+
+
+def test_route_cache_round_trip(tmp_path):
+    path = str(tmp_path / "state" / "routes.db")
+    assert cc._route_cache_get(path, "k") is None
+
+    cc._route_cache_put(path, "k", SUMMARY)
+
+    assert cc._route_cache_get(path, "k") == SUMMARY
+    assert cc._route_cache_get(path, "other") is None
+
+
+def test_route_cache_expired_row_is_miss(tmp_path, monkeypatch):
+    path = str(tmp_path / "routes.db")
+    now = cc.time.time()
+    cc._route_cache_put(path, "k", SUMMARY)
+
+    monkeypatch.setattr(cc.time, "time", lambda: now + cc.ROUTE_CACHE_TTL_SEC + 1)
+
+    assert cc._route_cache_get(path, "k") is None
+
+
+def test_route_cache_corrupt_db_is_miss(tmp_path):
+    path = tmp_path / "routes.db"
+    path.write_bytes(b"not a database" * 100)
+
+    assert cc._route_cache_get(str(path), "k") is None
+    cc._route_cache_put(str(path), "k", SUMMARY)  # must not raise
+
+
+def test_route_cache_bad_payload_is_miss(tmp_path):
+    path = str(tmp_path / "routes.db")
+    cc._route_cache_put(path, "k", SUMMARY)
+    db = sqlite3.connect(path)
+    with db:
+        for key, payload in [("null", None), ("list", b"[1, 2]"), ("no_ok", b'{"travel_sec": 1}'), ("junk", b"{")]:
+            db.execute("INSERT INTO routes VALUES (?, ?, ?)", (key, 2**62, payload))
+    db.close()
+
+    for key in ("null", "list", "no_ok", "junk"):
+        assert cc._route_cache_get(path, key) is None
+
+
+def test_route_cache_unusable_state_dir_does_not_raise(tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    path = str(blocker / "state" / "routes.db")  # parent is a file, so makedirs fails
+
+    assert cc._route_cache_get(path, "k") is None
+    cc._route_cache_put(path, "k", SUMMARY)
+
+
+def _today_key():
+    return date.today().isoformat()
+
+
+def test_mark_then_already_alerted_today(tmp_path):
+    state_dir = str(tmp_path / "state")
+    assert not cc.already_alerted_today(state_dir, _today_key())
+
+    cc.mark_alerted_today(state_dir)
+
+    assert cc.already_alerted_today(state_dir, _today_key())
+
+
+def test_old_marker_mtime_is_not_today(tmp_path):
+    state_dir = str(tmp_path)
+    cc.mark_alerted_today(state_dir)
+    old = time.time() - 3 * 86400
+    os.utime(os.path.join(state_dir, "last_alert_date.txt"), (old, old))
+
+    assert not cc.already_alerted_today(state_dir, _today_key())
+
+
+def test_already_alerted_missing_state_dir(tmp_path):
+    state_dir = tmp_path / "missing"
+
+    assert not cc.already_alerted_today(str(state_dir), _today_key())
+    assert not state_dir.exists()
+
+
+def test_history_format_size():
+    assert struct.calcsize(cc._HISTORY_FMT) == 21 + 2 * 2 * cc.HISTORY_SLOTS
+
+
+def test_history_round_trip(tmp_path):
+    state_dir = str(tmp_path / "state")
+    runs = list(range(cc.HISTORY_SLOTS))
+    skips = [cc.HISTORY_SLOTS - i for i in range(cc.HISTORY_SLOTS)]
+    bitmap = (1 << 0) | (1 << 63) | (1 << 64) | (1 << (cc.HISTORY_SLOTS - 1))
+
+    cc.save_hour_history(state_dir, bitmap, runs, skips)
+
+    assert os.path.getsize(os.path.join(state_dir, "hour_alert_bitmap.bin")) == struct.calcsize(cc._HISTORY_FMT)
+    assert cc.load_hour_history(state_dir) == (bitmap, runs, skips)
+
+
+def test_history_missing_or_wrong_size_resets(tmp_path):
+    empty = (0, [0] * cc.HISTORY_SLOTS, [0] * cc.HISTORY_SLOTS)
+    assert cc.load_hour_history(str(tmp_path)) == empty
+
+    (tmp_path / "hour_alert_bitmap.bin").write_bytes(b"\x00" * 357)
+    assert cc.load_hour_history(str(tmp_path)) == empty
+
+
+def test_record_hour_history_sets_bit_and_resets_skips(tmp_path):
+    state_dir = str(tmp_path)
+    slot = 100
+    cc.record_hour_skip(state_dir, slot)
+    cc.record_hour_skip(state_dir, slot)
+    cc.record_hour_history(state_dir, slot, alerted=True)
+
+    bitmap, runs, skips = cc.load_hour_history(state_dir)
+    assert (bitmap >> slot) & 1
+    assert runs[slot] == 1
+    assert skips[slot] == 0
+    assert sum(runs) == 1 and bitmap == 1 << slot
+
+
+def test_skip_rule_reprobes(tmp_path):
+    state_dir = str(tmp_path)
+    slot, min_runs, reprobe_every = 5, 3, 2
+
+    def should_skip():
+        return cc.should_skip_by_history(*cc.load_hour_history(state_dir), slot, min_runs, reprobe_every)
+
+    for _ in range(min_runs):
+        assert not should_skip()
+        cc.record_hour_history(state_dir, slot, alerted=False)
+
+    # Simulate main(): skip reprobe_every times, then fall through to a real check
+    decisions = []
+    for _ in range(2 * (reprobe_every + 1)):
+        skip = should_skip()
+        decisions.append(skip)
+        if skip:
+            cc.record_hour_skip(state_dir, slot)
+        else:
+            cc.record_hour_history(state_dir, slot, alerted=False)
+    assert decisions == [True, True, False, True, True, False]
+
+
+def test_skip_rule_never_skips_alerted_slot(tmp_path):
+    state_dir = str(tmp_path)
+    slot = 42
+    for _ in range(10):
+        cc.record_hour_history(state_dir, slot, alerted=False)
+    cc.record_hour_history(state_dir, slot, alerted=True)
+    assert not cc.should_skip_by_history(*cc.load_hour_history(state_dir), slot, 3, 2)
+
+
+def test_force_check_bypasses_dedupe_and_history_skip(tmp_path, monkeypatch):
+    state_dir = str(tmp_path)
+    slot = 7
+    for k, v in {
+        "TOMTOM_API_KEY": "k",
+        "COMMUTE_ORIGIN_LAT": "39.7392", "COMMUTE_ORIGIN_LNG": "-104.9903",
+        "COMMUTE_DEST_LAT": "39.75", "COMMUTE_DEST_LNG": "-105.0",
+        "DELAY_THRESHOLD_MIN": "99", "DELAY_THRESHOLD_PCT": "99",
+        "STATE_DIR": state_dir,
+        "SKIP_ON_HISTORY": "1", "SKIP_ON_HISTORY_MIN_RUNS": "1",
+        "FORCE_CHECK": "1",
+    }.items():
+        monkeypatch.setenv(k, v)
+    monkeypatch.setattr(cc, "history_slot", lambda now: slot)
+    cc.mark_alerted_today(state_dir)
+    cc.record_hour_history(state_dir, slot, alerted=False)
+    assert cc.should_skip_by_history(*cc.load_hour_history(state_dir), slot, 1, 4)
+
+    calls = []
+
+    def fake_summary(*args, **kwargs):
+        calls.append(args)
+        return dict(SUMMARY)
+
+    monkeypatch.setattr(cc, "tomtom_route_summary", fake_summary)
+    cc._config.cache_clear()
+    try:
+        assert cc.main() == 0
+    finally:
+        cc._config.cache_clear()
+
+    assert len(calls) == 1
+    _, runs, skips = cc.load_hour_history(state_dir)
+    assert runs[slot] == 2
+    assert skips[slot] == 0
+
+
+def _config_for(monkeypatch, origin_lat, origin_lng, dest_lat, dest_lng):
+    for k, v in {
+        "TOMTOM_API_KEY": "k",
+        "COMMUTE_ORIGIN_LAT": origin_lat, "COMMUTE_ORIGIN_LNG": origin_lng,
+        "COMMUTE_DEST_LAT": dest_lat, "COMMUTE_DEST_LNG": dest_lng,
+    }.items():
+        monkeypatch.setenv(k, v)
+    cc._config.cache_clear()
+    try:
+        return cc._config()
+    finally:
+        cc._config.cache_clear()
+
+
+def test_float_noise_maps_to_same_url_and_cache_key(monkeypatch):
+    clean = _config_for(monkeypatch, "39.7392", "-104.9903", "39.75", "-105.0")
+    noisy = _config_for(monkeypatch, "39.73920000001", "-104.99029999999", "39.7500000000001", "-105.00000000001")
+
+    assert clean.origin == noisy.origin == (39739200, -104990300)
+    assert clean.dest == noisy.dest == (39750000, -105000000)
+    assert clean.route_locs == noisy.route_locs == "39.739200,-104.990300:39.750000,-105.000000"
+    # Compare without the time bucket so the test can't straddle a bucket boundary
+    clean_key = cc._route_cache_key(clean.origin, clean.dest).rsplit("|", 1)[0]
+    noisy_key = cc._route_cache_key(noisy.origin, noisy.dest).rsplit("|", 1)[0]
+    assert clean_key == noisy_key == "39739200,-104990300|39750000,-105000000"